@@ -2,6 +2,7 @@
 
 from functools import lru_cache
 
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -15,9 +16,13 @@ class Settings(BaseSettings):
     # Scraping parameters
     min_followers: int = 3000
     max_depth: int = 3
+    scrape_concurrency: int = Field(default=4, gt=0)
+    requests_per_second: float = Field(default=0.5, gt=0)
 
     # Redis configuration
     redis_url: str = "redis://localhost:6379/0"
+    redis_max_connections: int = Field(default=32, gt=0)
+    redis_pool_timeout: float = Field(default=10, gt=0)
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -1,46 +1,95 @@
 """FastAPI application for Instagram followers scraper."""
 
-import json
+import asyncio
 import logging
 import uuid
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager, suppress
 
-import redis
-from fastapi import BackgroundTasks, FastAPI, HTTPException
+import orjson
+import redis.asyncio as redis
+from fastapi import FastAPI, HTTPException
+from redis.exceptions import NoScriptError, ResponseError
 
 from app.config import get_settings
-from app.models import AnalyzeRequest, FollowerInfo, JobResponse, JobStatus
+from app.models import (
+    FOLLOWER_LIST_ADAPTER,
+    AnalyzeRequest,
+    FollowerInfo,
+    JobResponse,
+    JobState,
+    JobStatus,
+)
 from app.scraper import InstagramScraper
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Minimum interval (seconds) between two progress writes for the same job
+PROGRESS_FLUSH_INTERVAL = 0.25
+
+# Redis keys of a job: state hash, results list and set of expanded accounts
+JOB_KEY = "job:{}".format
+JOB_RESULTS_KEY = "job:{}:results".format
+JOB_VISITED_KEY = "job:{}:visited".format
+
+# Redis TTL for a job's set of expanded accounts (24 hours)
+VISITED_TTL = 86400
+
+# Set of job ids that are pending or running, resumed on startup
+ACTIVE_JOBS_KEY = "jobs:active"
+
+# Set fields of a job hash only if the job still exists, so a late update
+# never recreates a deleted or expired job. ARGV holds field/value pairs.
+UPDATE_JOB_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+return redis.call('HSET', KEYS[1], unpack(ARGV))
+"""
+
 # Global instances
 redis_client: redis.Redis | None = None
 scraper: InstagramScraper | None = None
+update_job_sha: str | None = None
+
+# Running analysis tasks by job id, so they are not garbage collected and
+# can be stopped on shutdown
+running_jobs: dict[str, asyncio.Task] = {}
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler."""
-    global redis_client, scraper
+    global redis_client, scraper, update_job_sha
 
     settings = get_settings()
 
-    # Initialize Redis
-    redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+    # Initialize Redis. A blocking pool waits for a free connection when all
+    # are in use instead of raising, and is shared with the scraper so the
+    # limit covers every Redis call the app makes.
+    pool = redis.BlockingConnectionPool.from_url(
+        settings.redis_url,
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        decode_responses=True,
+    )
+    redis_client = redis.Redis.from_pool(pool)
+    update_job_sha = await redis_client.script_load(UPDATE_JOB_SCRIPT)
     logger.info("Connected to Redis")
 
     # Initialize scraper
-    scraper = InstagramScraper()
+    scraper = InstagramScraper(redis_client)
     if not scraper.login():
         logger.warning("Instagram login failed - scraping will not work")
 
+    await resume_jobs()
+
     yield
 
-    # Cleanup
+    # Cleanup: stop jobs while Redis is still open so their state can be saved
     if redis_client:
-        redis_client.close()
+        await stop_jobs()
+        await redis_client.aclose()
 
 
 app = FastAPI(
@@ -51,52 +100,188 @@ app = FastAPI(
 )
 
 
-def get_job(job_id: str) -> dict | None:
-    """Get job from Redis."""
-    data = redis_client.get(f"job:{job_id}")
-    return json.loads(data) if data else None
+def parse_results(results: list[str]) -> list[FollowerInfo]:
+    """Validate stored results straight from JSON, without building dicts first."""
+    return FOLLOWER_LIST_ADAPTER.validate_json(f"[{','.join(results)}]")
+
+
+async def load_job(job_id: str) -> tuple[JobState, list[FollowerInfo]] | None:
+    """Load job state and results from Redis in a single round-trip."""
+    try:
+        fields, results = await (
+            redis_client.pipeline()
+            .hgetall(JOB_KEY(job_id))
+            .lrange(JOB_RESULTS_KEY(job_id), 0, -1)
+            .execute()
+        )
+    except ResponseError as e:
+        if "WRONGTYPE" not in str(e):
+            raise
+        return await load_legacy_job(job_id)
+    if not fields:
+        return None
+    return JobState.from_hash(fields), parse_results(results)
+
+
+async def load_legacy_job(job_id: str) -> tuple[JobState, list[FollowerInfo]] | None:
+    """Load a job stored by earlier versions as a single JSON string at ``job:{id}``."""
+    data = await redis_client.get(JOB_KEY(job_id))
+    if not data:
+        return None
+    job = orjson.loads(data)
+    results = FOLLOWER_LIST_ADAPTER.validate_python(job.pop("results", None) or [])
+    return JobState.from_hash(job), results
+
+
+async def update_job(job_key: str, **fields: str):
+    """Atomically update fields of an existing job in a single round-trip."""
+    global update_job_sha
+
+    args = [item for pair in fields.items() for item in pair]
+    try:
+        await redis_client.evalsha(update_job_sha, 1, job_key, *args)
+    except NoScriptError:
+        # Script cache was flushed (e.g. Redis restart), load it again
+        update_job_sha = await redis_client.script_load(UPDATE_JOB_SCRIPT)
+        await redis_client.evalsha(update_job_sha, 1, job_key, *args)
+
+
+async def run_analysis(job_id: str, username: str, depth: int):
+    """Background task to run the analysis.
+
+    Job state lives in a Redis hash (``job:{id}``) so each update only
+    rewrites the fields that changed. Results are appended to a separate list
+    (``job:{id}:results``) as soon as the scraper finds them, so partial
+    results can be polled. Progress messages are coalesced so that at most one
+    is written per PROGRESS_FLUSH_INTERVAL.
+
+    Accounts already expanded are tracked in ``job:{id}:visited``, written in
+    the same transaction as their results. A job stays in ``jobs:active``
+    until it completes or fails, so one interrupted by a shutdown or crash is
+    run again on startup, and continues from the stored results instead of
+    fetching those accounts again.
+    """
+    min_followers = get_settings().min_followers
+    job_key = JOB_KEY(job_id)
+    results_key = JOB_RESULTS_KEY(job_id)
+    visited_key = JOB_VISITED_KEY(job_id)
+
+    # Holds only the latest progress message; a single writer task flushes it
+    # at most once per PROGRESS_FLUSH_INTERVAL
+    progress_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=1)
+
+    async def on_progress(msg: str):
+        if progress_queue.full():
+            progress_queue.get_nowait()
+        progress_queue.put_nowait(msg)
+
+    async def write_progress():
+        while True:
+            msg = await progress_queue.get()
+            await update_job(job_key, progress=msg)
+            await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+
+    try:
+        # Results and expanded accounts left by an interrupted run, if any
+        results, expanded = await (
+            redis_client.pipeline().lrange(results_key, 0, -1).smembers(visited_key).execute()
+        )
+        previous = parse_results(results)
+
+        await update_job(job_key, status=JobStatus.RUNNING.value)
+
+        progress_writer = asyncio.create_task(write_progress())
+        count = len(previous)
+        try:
+            # aclosing() stops the scraper's pending requests if a write fails
+            async with aclosing(
+                scraper.analyze_recursive(
+                    username=username,
+                    max_depth=depth,
+                    min_followers=min_followers,
+                    on_progress=on_progress,
+                    expanded=expanded,
+                    previous=previous,
+                )
+            ) as expansions:
+                async for account, followers in expansions:
+                    # Push an account's results and mark it expanded in one
+                    # transaction, so a resumed run never pushes them twice
+                    pipe = redis_client.pipeline()
+                    if followers:
+                        pipe.rpush(results_key, *(f.model_dump_json() for f in followers))
+                    await pipe.sadd(visited_key, account).expire(visited_key, VISITED_TTL).execute()
+                    count += len(followers)
+        finally:
+            # Stop the writer so a stale message cannot overwrite the final state
+            progress_writer.cancel()
+            with suppress(asyncio.CancelledError):
+                await progress_writer
+
+        await update_job(
+            job_key,
+            status=JobStatus.COMPLETED.value,
+            progress=f"Completed: found {count} accounts",
+        )
+        await redis_client.srem(ACTIVE_JOBS_KEY, job_id)
+
+        logger.info(f"Job {job_id} completed with {count} results")
 
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        await update_job(job_key, status=JobStatus.FAILED.value, error=str(e))
+        await redis_client.srem(ACTIVE_JOBS_KEY, job_id)
 
-def save_job(job_id: str, job_data: dict):
-    """Save job to Redis."""
-    redis_client.set(f"job:{job_id}", json.dumps(job_data))
 
+def start_job(job_id: str, username: str, depth: int) -> None:
+    """Run an analysis in the background and keep track of its task."""
+    task = asyncio.create_task(run_analysis(job_id, username, depth))
+    running_jobs[job_id] = task
 
-def run_analysis(job_id: str, username: str, depth: int):
-    """Background task to run the analysis."""
-    settings = get_settings()
+    def on_done(task: asyncio.Task) -> None:
+        running_jobs.pop(job_id, None)
+        # Only reached when the failure itself could not be saved, e.g. Redis
+        # is down. The job stays active and is retried on the next startup.
+        if not task.cancelled() and task.exception():
+            logger.error(f"Job {job_id} could not be saved: {task.exception()}")
 
-    job = get_job(job_id)
-    job["status"] = JobStatus.RUNNING.value
-    save_job(job_id, job)
+    task.add_done_callback(on_done)
 
-    def on_progress(msg: str):
-        job = get_job(job_id)
-        job["progress"] = msg
-        save_job(job_id, job)
 
-    try:
-        results = scraper.analyze_recursive(
-            username=username,
-            max_depth=depth,
-            min_followers=settings.min_followers,
-            on_progress=on_progress,
-        )
+async def resume_jobs() -> None:
+    """Restart jobs left pending or running by a previous process."""
+    job_ids = list(await redis_client.smembers(ACTIVE_JOBS_KEY))
+    if not job_ids:
+        return
 
-        job = get_job(job_id)
-        job["status"] = JobStatus.COMPLETED.value
-        job["results"] = [r.model_dump() for r in results]
-        job["progress"] = f"Completed: found {len(results)} accounts"
-        save_job(job_id, job)
+    pipe = redis_client.pipeline()
+    for job_id in job_ids:
+        pipe.hgetall(JOB_KEY(job_id))
 
-        logger.info(f"Job {job_id} completed with {len(results)} results")
+    finished = []
+    for job_id, fields in zip(job_ids, await pipe.execute(), strict=True):
+        # Skip jobs that expired, were deleted or finished before being removed
+        job = JobState.from_hash(fields) if fields else None
+        if job is None or job.status not in (JobStatus.PENDING, JobStatus.RUNNING):
+            finished.append(job_id)
+            continue
+        logger.info(f"Resuming job {job_id}")
+        start_job(job_id, job.target_username, job.depth)
+
+    if finished:
+        await redis_client.srem(ACTIVE_JOBS_KEY, *finished)
 
-    except Exception as e:
-        logger.error(f"Job {job_id} failed: {e}")
-        job = get_job(job_id)
-        job["status"] = JobStatus.FAILED.value
-        job["error"] = str(e)
-        save_job(job_id, job)
+
+async def stop_jobs() -> None:
+    """Cancel running analyses, leaving them active to be resumed on startup."""
+    jobs = dict(running_jobs)
+    for task in jobs.values():
+        task.cancel()
+    await asyncio.gather(*jobs.values(), return_exceptions=True)
+
+    for job_id in jobs:
+        logger.warning(f"Job {job_id} interrupted by shutdown")
+        await update_job(JOB_KEY(job_id), progress="Interrupted by shutdown, resuming on restart")
 
 
 @app.get("/health")
@@ -106,7 +291,7 @@ async def health_check():
 
 
 @app.post("/analyze", response_model=JobResponse)
-async def create_analysis(request: AnalyzeRequest, background_tasks: BackgroundTasks):
+async def create_analysis(request: AnalyzeRequest):
     """Start a new follower analysis job.
 
     Returns a job_id that can be used to poll for results.
@@ -121,33 +306,34 @@ async def create_analysis(request: AnalyzeRequest, background_tasks: BackgroundT
 
     # Create job
     job_id = str(uuid.uuid4())
-    job_data = {
-        "job_id": job_id,
-        "status": JobStatus.PENDING.value,
-        "target_username": request.username,
-        "depth": request.depth,
-        "min_followers": settings.min_followers,
-        "results": [],
-        "error": None,
-        "progress": "Job created, waiting to start",
-    }
-    save_job(job_id, job_data)
+    job = JobState(
+        job_id=job_id,
+        status=JobStatus.PENDING,
+        target_username=request.username,
+        depth=request.depth,
+        min_followers=settings.min_followers,
+        progress="Job created, waiting to start",
+    )
+    await (
+        redis_client.pipeline()
+        .hset(JOB_KEY(job_id), mapping=job.to_hash())
+        .sadd(ACTIVE_JOBS_KEY, job_id)
+        .execute()
+    )
 
     # Start background task
-    background_tasks.add_task(run_analysis, job_id, request.username, request.depth)
+    start_job(job_id, request.username, request.depth)
 
-    return JobResponse(**job_data)
+    return job.to_response()
 
 
 @app.get("/analyze/{job_id}", response_model=JobResponse)
 async def get_analysis(job_id: str):
     """Get the status and results of an analysis job."""
-    job = get_job(job_id)
+    job = await load_job(job_id)
 
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    # Convert results back to FollowerInfo objects
-    job["results"] = [FollowerInfo(**r) for r in job.get("results", [])]
-
-    return JobResponse(**job)
+    state, results = job
+    return state.to_response(results)
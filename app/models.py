@@ -1,8 +1,9 @@
-"""Pydantic models for API requests and responses."""
+"""Pydantic models for API requests and responses, and internal job state."""
 
 from enum import Enum
 
-from pydantic import BaseModel, Field
+import msgspec
+from pydantic import BaseModel, Field, TypeAdapter
 
 
 class JobStatus(str, Enum):
@@ -33,6 +34,12 @@ class FollowerInfo(BaseModel):
     is_private: bool
     depth: int
 
+    model_config = {"frozen": True, "extra": "ignore"}
+
+
+# Compiled once and reused to (de)serialize stored result lists
+FOLLOWER_LIST_ADAPTER = TypeAdapter(list[FollowerInfo])
+
 
 class JobResponse(BaseModel):
     """Response with job status and results."""
@@ -45,3 +52,32 @@ class JobResponse(BaseModel):
     results: list[FollowerInfo] = []
     error: str | None = None
     progress: str | None = None
+
+
+class JobState(msgspec.Struct, omit_defaults=True):
+    """Internal job state, stored as the ``job:{id}`` Redis hash.
+
+    Kept out of pydantic: it is only converted to a JobResponse at the API
+    boundary.
+    """
+
+    job_id: str
+    status: JobStatus
+    target_username: str
+    depth: int
+    min_followers: int
+    error: str | None = None
+    progress: str | None = None
+
+    @classmethod
+    def from_hash(cls, fields: dict[str, str]) -> "JobState":
+        """Build from HGETALL output, where every value is a string."""
+        return msgspec.convert(fields, cls, strict=False)
+
+    def to_hash(self) -> dict:
+        """Fields to HSET. Unset optional fields are omitted."""
+        return msgspec.to_builtins(self)
+
+    def to_response(self, results: list[FollowerInfo] | None = None) -> JobResponse:
+        """Convert to the public API response model."""
+        return JobResponse(**msgspec.structs.asdict(self), results=results or [])
@@ -1,39 +1,71 @@
 """Instagram scraper using instagrapi."""
 
-import json
+import asyncio
 import logging
-import random
 import time
-from collections.abc import Callable
+from collections import Counter, OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable
 
-import redis
+import orjson
+import redis.asyncio as redis
 from instagrapi import Client
 from instagrapi.exceptions import ClientError, LoginRequired
+from instagrapi.types import UserShort
 
 from app.config import get_settings
 from app.models import FollowerInfo
 
 logger = logging.getLogger(__name__)
 
+# Redis key of a cached user profile
+USER_KEY = "user:{}".format
+
 # Redis cache TTL for user profiles (24 hours)
 USER_CACHE_TTL = 86400
 
+# Maximum number of user profiles kept in the in-process cache
+USER_MEM_CACHE_SIZE = 50_000
+
+# In-process cache TTL for user profiles (1 hour)
+USER_MEM_CACHE_TTL = 3600
+
+
+class RateLimiter:
+    """Spaces out calls to enforce a global requests-per-second budget.
+
+    Each caller reserves the next free slot and sleeps until it is due, so
+    concurrent fetches are throttled together instead of each sleeping a
+    fixed delay.
+    """
+
+    def __init__(self, rps: float):
+        self.interval = 1 / rps
+        self.next_ok = 0.0
+
+    async def wait(self) -> None:
+        """Wait for the next available request slot."""
+        # No await between reading and reserving the slot, so this is atomic
+        # within the event loop
+        now = time.monotonic()
+        delay = max(0.0, self.next_ok - now)
+        self.next_ok = max(now, self.next_ok) + self.interval
+        await asyncio.sleep(delay)
+
 
 class InstagramScraper:
-    """Scraper for Instagram followers with recursive depth support."""
+    """Scraper for Instagram followers with depth-based traversal support."""
 
-    def __init__(self):
+    def __init__(self, redis_client: redis.Redis):
         self.client = Client()
+        # Shared with the app, which owns and closes it
+        self.redis_client = redis_client
         self.settings = get_settings()
         self._logged_in = False
-        self._redis: redis.Redis | None = None
-
-    @property
-    def redis_client(self) -> redis.Redis:
-        """Lazy Redis connection for user cache."""
-        if self._redis is None:
-            self._redis = redis.from_url(self.settings.redis_url)
-        return self._redis
+        self.limiter = RateLimiter(self.settings.requests_per_second)
+        # username -> (expiry on the monotonic clock, user info)
+        self._mem_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task[dict | None]] = {}
+        self._waiters: Counter[str] = Counter()
 
     def login(self) -> bool:
         """Login to Instagram. Returns True if successful."""
@@ -64,40 +96,130 @@ class InstagramScraper:
             logger.error(f"Login failed: {e}")
             return False
 
-    def _random_delay(self, min_sec: float = 1.0, max_sec: float = 3.0) -> None:
-        """Add random delay to avoid rate limiting."""
-        delay = random.uniform(min_sec, max_sec)
-        time.sleep(delay)
+    def _remember_user(self, username: str, user_info: dict) -> None:
+        """Store user info in the in-process LRU cache."""
+        self._mem_cache[username] = (time.monotonic() + USER_MEM_CACHE_TTL, user_info)
+        self._mem_cache.move_to_end(username)
+        if len(self._mem_cache) > USER_MEM_CACHE_SIZE:
+            self._mem_cache.popitem(last=False)
+
+    def _recall_user(self, username: str) -> dict | None:
+        """Get user info from the in-process LRU cache if it has not expired."""
+        entry = self._mem_cache.get(username)
+        if entry is None:
+            return None
+        expires_at, user_info = entry
+        if expires_at <= time.monotonic():
+            del self._mem_cache[username]
+            return None
+        self._mem_cache.move_to_end(username)
+        return user_info
+
+    async def _get_cached_user(self, username: str) -> dict | None:
+        """Get user info from the in-process cache, then Redis."""
+        user_info = self._recall_user(username)
+        if user_info is not None:
+            return user_info
 
-    def _get_cached_user(self, username: str) -> dict | None:
-        """Get user info from Redis cache."""
         try:
-            cached = self.redis_client.get(f"user:{username}")
+            cached = await self.redis_client.get(USER_KEY(username))
             if cached:
                 logger.debug(f"Cache hit for user {username}")
-                return json.loads(cached)
+                user_info = orjson.loads(cached)
+                self._remember_user(username, user_info)
+                return user_info
         except redis.RedisError as e:
             logger.warning(f"Redis cache error: {e}")
         return None
 
-    def _cache_user(self, username: str, user_info: dict) -> None:
-        """Cache user info in Redis."""
+    async def _cache_user(self, username: str, user_info: dict) -> None:
+        """Cache user info in memory and in Redis."""
+        self._remember_user(username, user_info)
         try:
-            self.redis_client.setex(f"user:{username}", USER_CACHE_TTL, json.dumps(user_info))
+            await self.redis_client.setex(
+                USER_KEY(username), USER_CACHE_TTL, orjson.dumps(user_info)
+            )
             logger.debug(f"Cached user {username}")
         except redis.RedisError as e:
             logger.warning(f"Redis cache error: {e}")
 
-    def get_user_info(self, username: str) -> dict | None:
+    async def _get_cached_users(self, usernames: list[str]) -> dict[str, dict | None]:
+        """Get several users from the in-process cache, then Redis with a single MGET."""
+        found = {username: self._recall_user(username) for username in usernames}
+        remaining = [username for username, user_info in found.items() if user_info is None]
+        if not remaining:
+            return found
+
+        try:
+            cached = await self.redis_client.mget(list(map(USER_KEY, remaining)))
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache error: {e}")
+            return found
+
+        for username, data in zip(remaining, cached, strict=True):
+            if data:
+                found[username] = user_info = orjson.loads(data)
+                self._remember_user(username, user_info)
+        return found
+
+    async def _cache_users(self, users: dict[str, dict]) -> None:
+        """Cache several users in memory and in Redis with a single pipeline."""
+        if not users:
+            return
+        for username, user_info in users.items():
+            self._remember_user(username, user_info)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for username, user_info in users.items():
+                pipe.setex(USER_KEY(username), USER_CACHE_TTL, orjson.dumps(user_info))
+            await pipe.execute()
+            logger.debug(f"Cached {len(users)} users")
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache error: {e}")
+
+    async def get_user_info(self, username: str) -> dict | None:
         """Get user information by username (with Redis cache)."""
         # Check cache first
-        cached = self._get_cached_user(username)
+        cached = await self._get_cached_user(username)
         if cached:
             return cached
 
+        user_info = await self._fetch_user_info(username)
+        if user_info:
+            await self._cache_user(username, user_info)
+        return user_info
+
+    async def _fetch_user_info(self, username: str) -> dict | None:
+        """Get user information by username from Instagram, bypassing the cache.
+
+        Concurrent calls for the same username share a single request, which
+        is cancelled once every caller waiting on it has been cancelled.
+        """
+        task = self._inflight.get(username)
+        if task is None:
+            task = asyncio.create_task(self._request_user_info(username))
+            self._inflight[username] = task
+            task.add_done_callback(lambda _: self._inflight.pop(username, None))
+
+        self._waiters[username] += 1
+        try:
+            # Shield so a cancelled caller does not cancel the request for the others
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[username] -= 1
+            if not self._waiters[username]:
+                del self._waiters[username]
+                # Unregister now rather than in the done callback, so a caller
+                # arriving before the task finishes cancelling starts a new one
+                if self._inflight.get(username) is task:
+                    del self._inflight[username]
+                task.cancel()
+
+    async def _request_user_info(self, username: str) -> dict | None:
+        """Request user information from Instagram."""
         try:
-            self._random_delay()
-            user = self.client.user_info_by_username(username)
+            await self.limiter.wait()
+            user = await asyncio.to_thread(self.client.user_info_by_username, username)
             user_info = {
                 "user_id": user.pk,
                 "username": user.username,
@@ -106,120 +228,184 @@ class InstagramScraper:
                 "following_count": user.following_count,
                 "is_private": user.is_private,
             }
-            # Cache the result
-            self._cache_user(username, user_info)
             return user_info
         except ClientError as e:
             logger.error(f"Failed to get user info for {username}: {e}")
             return None
 
-    def get_followers(self, user_id: int, amount: int = 0) -> list[dict]:
+    async def _request_followers(self, user_id: int, amount: int = 0) -> list[UserShort]:
+        """Request the followers of a user from Instagram."""
+        await self.limiter.wait()
+        followers = await asyncio.to_thread(self.client.user_followers, user_id, amount=amount)
+        return list(followers.values())
+
+    async def get_followers(self, user_id: int, amount: int = 0) -> list[dict]:
         """Get followers of a user. amount=0 means all followers."""
         try:
-            self._random_delay()
-            followers = self.client.user_followers(user_id, amount=amount)
-            return [
-                {
-                    "user_id": user.pk,
-                    "username": user.username,
-                    "full_name": user.full_name,
-                    "follower_count": getattr(user, "follower_count", 0),
-                    "following_count": getattr(user, "following_count", 0),
-                    "is_private": user.is_private,
-                }
-                for user in followers.values()
-            ]
+            followers = await self._request_followers(user_id, amount)
         except ClientError as e:
             logger.error(f"Failed to get followers for user {user_id}: {e}")
             return []
 
-    def analyze_recursive(
+        # UserShort carries no follower or following count, those need the
+        # full profile from get_user_info
+        return [
+            {
+                "user_id": user.pk,
+                "username": user.username,
+                "full_name": user.full_name,
+                "is_private": user.is_private,
+            }
+            for user in followers
+        ]
+
+    async def _analyze_user(
         self,
         username: str,
-        current_depth: int = 1,
-        max_depth: int = 1,
-        min_followers: int = 3000,
-        visited: set[str] | None = None,
-        on_progress: Callable[[str], None] | None = None,
+        depth: int,
+        min_followers: int,
+        limit: asyncio.Semaphore,
+        on_progress: Callable[[str], Awaitable[None]] | None = None,
     ) -> list[FollowerInfo]:
-        """Recursively analyze followers.
+        """Get the followers of a single account that meet the criteria.
 
         Args:
-            username: Target Instagram username
-            current_depth: Current recursion depth
-            max_depth: Maximum depth to traverse
+            username: Instagram username to expand
+            depth: Depth assigned to the followers found
             min_followers: Minimum follower count filter
-            visited: Set of already visited usernames
+            limit: Semaphore bounding concurrent Instagram calls
             on_progress: Callback for progress updates
 
         Returns:
             List of FollowerInfo objects matching the criteria
         """
-        if visited is None:
-            visited = set()
-
-        if username in visited:
-            return []
-
-        visited.add(username)
-        results = []
-
         if on_progress:
-            on_progress(f"Analyzing {username} at depth {current_depth}")
+            await on_progress(f"Analyzing {username} at depth {depth}")
 
         # Get target user info
-        user_info = self.get_user_info(username)
+        async with limit:
+            user_info = await self.get_user_info(username)
         if not user_info:
             logger.warning(f"Could not get info for {username}")
-            return results
+            return []
 
         if user_info["is_private"]:
             logger.info(f"Skipping private account: {username}")
-            return results
+            return []
 
         # Get followers
-        followers = self.get_followers(user_info["user_id"])
+        async with limit:
+            followers = await self.get_followers(user_info["user_id"])
         logger.info(f"Found {len(followers)} followers for {username}")
 
-        for follower in followers:
-            # Use follower_count from get_followers() if available (>0)
-            # Only fetch full user info if count is missing/zero
-            if follower.get("follower_count", 0) > 0:
-                follower_count = follower["follower_count"]
-                # Quick filter: skip if definitely below threshold
-                if follower_count < min_followers:
-                    continue
-                follower_info = follower  # Use existing data
-            else:
-                # Need to fetch full info for accurate follower count
-                follower_info = self.get_user_info(follower["username"])
-                if not follower_info:
-                    continue
-                follower_count = follower_info["follower_count"]
-
-            # Check if meets minimum followers criteria
-            if follower_count >= min_followers:
-                results.append(
-                    FollowerInfo(
-                        username=follower_info["username"],
-                        full_name=follower_info["full_name"],
-                        follower_count=follower_info["follower_count"],
-                        following_count=follower_info["following_count"],
-                        is_private=follower_info["is_private"],
-                        depth=current_depth,
-                    )
-                )
+        # One MGET for the whole follower list, then only fetch cache misses
+        cached = await self._get_cached_users([follower["username"] for follower in followers])
+        misses = [name for name, follower_info in cached.items() if follower_info is None]
+
+        async def fetch(name: str) -> dict | None:
+            async with limit:
+                return await self._fetch_user_info(name)
+
+        tasks = [asyncio.create_task(fetch(name)) for name in misses]
+        try:
+            fetched = await asyncio.gather(*tasks)
+        finally:
+            # If one fetch failed, do not leave the others calling Instagram
+            for task in tasks:
+                task.cancel()
+        await self._cache_users(
+            {name: info for name, info in zip(misses, fetched, strict=True) if info}
+        )
+
+        # Fields come straight from instagrapi models, skip pydantic validation
+        build = FollowerInfo.model_construct
+        return [
+            build(
+                username=follower_info["username"],
+                full_name=follower_info["full_name"],
+                follower_count=follower_info["follower_count"],
+                following_count=follower_info["following_count"],
+                is_private=follower_info["is_private"],
+                depth=depth,
+            )
+            for follower_info in [*cached.values(), *fetched]
+            if follower_info and follower_info["follower_count"] >= min_followers
+        ]
+
+    async def analyze_recursive(
+        self,
+        username: str,
+        max_depth: int = 1,
+        min_followers: int = 3000,
+        on_progress: Callable[[str], Awaitable[None]] | None = None,
+        expanded: set[str] | None = None,
+        previous: list[FollowerInfo] | None = None,
+    ) -> AsyncIterator[tuple[str, list[FollowerInfo]]]:
+        """Analyze followers breadth-first down to max_depth.
+
+        All accounts of a depth level are expanded concurrently, with at most
+        ``scrape_concurrency`` Instagram calls in flight at once. The matching
+        followers of each account are yielded as soon as it is expanded.
 
-                # Recurse if not at max depth and not private
-                if current_depth < max_depth and not follower_info["is_private"]:
-                    nested = self.analyze_recursive(
-                        follower_info["username"],
-                        current_depth + 1,
-                        max_depth,
-                        min_followers,
-                        visited,
-                        on_progress,
-                    )
-                    results.extend(nested)
-
-        return results
+        An interrupted run is resumed by passing the accounts it had expanded
+        along with the results it produced for them: those accounts are not
+        fetched again, and their followers are taken from ``previous``
+        instead.
+
+        Args:
+            username: Target Instagram username
+            max_depth: Maximum depth to traverse
+            min_followers: Minimum follower count filter
+            on_progress: Callback for progress updates
+            expanded: Accounts already expanded by an interrupted run
+            previous: Results already produced by an interrupted run
+
+        Yields:
+            Each newly expanded account with its followers matching the criteria
+        """
+        limit = asyncio.Semaphore(self.settings.scrape_concurrency)
+        visited: set[str] = {username}
+        queue: deque[tuple[str, int]] = deque([(username, 1)])
+
+        expanded = expanded or set()
+        previous_by_depth: dict[int, list[FollowerInfo]] = {}
+        for follower in previous or []:
+            previous_by_depth.setdefault(follower.depth, []).append(follower)
+
+        def enqueue(followers: list[FollowerInfo], depth: int) -> None:
+            # Go deeper if not at max depth, skipping private accounts
+            if depth >= max_depth:
+                return
+            for follower in followers:
+                if not follower.is_private and follower.username not in visited:
+                    visited.add(follower.username)
+                    queue.append((follower.username, depth + 1))
+
+        async def expand(name: str, depth: int) -> tuple[str, list[FollowerInfo]]:
+            return name, await self._analyze_user(name, depth, min_followers, limit, on_progress)
+
+        while queue:
+            # Pop the whole current depth level. Accounts are marked visited
+            # when enqueued, so the queue never holds duplicates.
+            depth = queue[0][1]
+            layer = []
+            while queue and queue[0][1] == depth:
+                layer.append(queue.popleft()[0])
+
+            # Followers of accounts expanded by an earlier run are already in
+            # the results, only keep traversing from them
+            pending = [name for name in layer if name not in expanded]
+            if len(pending) < len(layer):
+                enqueue(previous_by_depth.get(depth, []), depth)
+
+            tasks = [asyncio.create_task(expand(name, depth)) for name in pending]
+            try:
+                for expansion in asyncio.as_completed(tasks):
+                    name, followers = await expansion
+                    yield name, followers
+                    enqueue(followers, depth)
+            finally:
+                # Stop the rest of the level if an expansion failed or the
+                # caller stopped consuming the results
+                for task in tasks:
+                    task.cancel()
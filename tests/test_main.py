@@ -1,36 +1,126 @@
 """Tests for FastAPI endpoints."""
 
+import asyncio
 import json
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
+from redis.exceptions import ResponseError
 
 
 @pytest.fixture
 def mock_redis():
-    """Mock Redis client with proper job storage."""
-    storage = {}
+    """Mock Redis client with in-memory hash and list storage."""
+    hashes = {}
+    lists = {}
+    sets = {}
+    # Plain string keys, as jobs were stored before the hash layout
+    strings = {}
 
-    def mock_get(key):
-        return storage.get(key)
+    def encode(value):
+        return value if isinstance(value, str | bytes) else str(value)
 
-    def mock_set(key, value):
-        storage[key] = value
-        return True
+    def mock_hset(key, field=None, value=None, mapping=None):
+        job = hashes.setdefault(key, {})
+        if field is not None:
+            job[field] = encode(value)
+        for k, v in (mapping or {}).items():
+            job[k] = encode(v)
+        return 1
+
+    def mock_hgetall(key):
+        if key in strings:
+            raise ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return dict(hashes.get(key, {}))
+
+    def mock_rpush(key, *values):
+        lists.setdefault(key, []).extend(values)
+        return len(lists[key])
+
+    def mock_lrange(key, start, end):
+        return list(lists.get(key, []))
+
+    def mock_sadd(key, *members):
+        sets.setdefault(key, set()).update(members)
+        return len(members)
+
+    def mock_srem(key, *members):
+        sets.get(key, set()).difference_update(members)
+        return len(members)
+
+    def mock_smembers(key):
+        return set(sets.get(key, set()))
+
+    def mock_evalsha(sha, numkeys, key, *args):
+        # Mirrors UPDATE_JOB_SCRIPT
+        if key not in hashes:
+            return 0
+        return mock_hset(key, mapping=dict(zip(args[::2], args[1::2], strict=True)))
 
     mock = MagicMock()
-    mock.get.side_effect = mock_get
-    mock.set.side_effect = mock_set
+    mock.hashes = hashes
+    mock.lists = lists
+    mock.sets = sets
+    mock.strings = strings
+    mock.hset = AsyncMock(side_effect=mock_hset)
+    mock.hgetall = AsyncMock(side_effect=mock_hgetall)
+    mock.get = AsyncMock(side_effect=strings.get)
+    mock.rpush = AsyncMock(side_effect=mock_rpush)
+    mock.lrange = AsyncMock(side_effect=mock_lrange)
+    mock.sadd = AsyncMock(side_effect=mock_sadd)
+    mock.srem = AsyncMock(side_effect=mock_srem)
+    mock.smembers = AsyncMock(side_effect=mock_smembers)
+    mock.evalsha = AsyncMock(side_effect=mock_evalsha)
+    mock.script_load = AsyncMock(return_value="update-job-sha")
+    mock.aclose = AsyncMock()
+    commands = {
+        "hset": mock_hset,
+        "hgetall": mock_hgetall,
+        "rpush": mock_rpush,
+        "lrange": mock_lrange,
+        "sadd": mock_sadd,
+        "smembers": mock_smembers,
+        "expire": lambda key, ttl: True,
+    }
+
+    def mock_pipeline(transaction=True):
+        queued = []
+        pipe = MagicMock()
+
+        def queue(name):
+            def command(*args, **kwargs):
+                queued.append((name, args, kwargs))
+                return pipe
+
+            return command
+
+        for name in commands:
+            getattr(pipe, name).side_effect = queue(name)
+        pipe.execute = AsyncMock(
+            side_effect=lambda: [commands[name](*args, **kwargs) for name, args, kwargs in queued]
+        )
+        return pipe
+
+    mock.pipeline.side_effect = mock_pipeline
     return mock
 
 
+async def stream(items):
+    """Yield items from an async generator, like InstagramScraper.analyze_recursive.
+
+    Items are (account, followers) pairs.
+    """
+    for item in items:
+        yield item
+
+
 @pytest.fixture
 def mock_scraper():
     """Mock InstagramScraper."""
     mock = MagicMock()
     mock.login.return_value = True
-    mock.analyze_recursive.return_value = []
+    mock.analyze_recursive.side_effect = lambda **kwargs: stream([])
     return mock
 
 
@@ -40,7 +130,8 @@ def client(mock_redis, mock_scraper):
     with (
         patch("app.main.redis_client", mock_redis),
         patch("app.main.scraper", mock_scraper),
-        patch("redis.from_url", return_value=mock_redis),
+        patch("redis.asyncio.BlockingConnectionPool.from_url"),
+        patch("redis.asyncio.Redis.from_pool", return_value=mock_redis),
         patch("app.main.InstagramScraper", return_value=mock_scraper),
     ):
         from app.main import app
@@ -64,8 +155,6 @@ class TestAnalyzeEndpoint:
 
     def test_analyze_creates_job(self, client, mock_redis):
         """POST /analyze should create a new job."""
-        mock_redis.get.return_value = None
-
         response = client.post(
             "/analyze",
             json={"username": "testuser", "depth": 1}
@@ -115,22 +204,257 @@ class TestGetAnalysisEndpoint:
     def test_get_analysis_returns_job(self, client, mock_redis):
         """GET /analyze/{job_id} should return job data."""
         # Pre-populate job in mock storage
-        mock_redis.set(
-            "job:test-job-id",
+        mock_redis.hashes["job:test-job-id"] = {
+            "job_id": "test-job-id",
+            "status": "completed",
+            "target_username": "testuser",
+            "depth": "1",
+            "min_followers": "3000",
+            "progress": "Completed",
+        }
+        mock_redis.lists["job:test-job-id:results"] = [
             json.dumps({
-                "job_id": "test-job-id",
-                "status": "completed",
-                "target_username": "testuser",
+                "username": "influencer",
+                "full_name": "Influencer",
+                "follower_count": 5000,
+                "following_count": 200,
+                "is_private": False,
                 "depth": 1,
-                "min_followers": 3000,
-                "results": [],
-                "error": None,
-                "progress": "Completed",
-            }),
-        )
+            })
+        ]
 
         response = client.get("/analyze/test-job-id")
         assert response.status_code == 200
         data = response.json()
         assert data["job_id"] == "test-job-id"
         assert data["status"] == "completed"
+        assert data["depth"] == 1
+        assert data["results"][0]["username"] == "influencer"
+
+    def test_get_analysis_returns_legacy_job(self, client, mock_redis):
+        """Jobs stored as a single JSON string by earlier versions should still load."""
+        mock_redis.strings["job:old-job-id"] = json.dumps({
+            "job_id": "old-job-id",
+            "status": "completed",
+            "target_username": "testuser",
+            "depth": 1,
+            "min_followers": 3000,
+            "results": [{
+                "username": "influencer",
+                "full_name": "Influencer",
+                "follower_count": 5000,
+                "following_count": 200,
+                "is_private": False,
+                "depth": 1,
+            }],
+            "error": None,
+            "progress": "Completed: found 1 accounts",
+        })
+
+        response = client.get("/analyze/old-job-id")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "completed"
+        assert data["progress"] == "Completed: found 1 accounts"
+        assert data["results"][0]["username"] == "influencer"
+
+
+class TestRunAnalysis:
+    """Tests for the run_analysis background task."""
+
+    @staticmethod
+    def make_follower(i):
+        from app.models import FollowerInfo
+
+        return FollowerInfo(
+            username=f"user{i}",
+            full_name=f"User {i}",
+            follower_count=5000,
+            following_count=100,
+            is_private=False,
+            depth=1,
+        )
+
+    async def test_run_analysis_throttles_progress(self, client, mock_redis, mock_scraper):
+        """Progress updates should be coalesced instead of written one by one."""
+        from app.main import run_analysis
+
+        async def analyze(on_progress, **kwargs):
+            for i in range(100):
+                await on_progress(f"step {i}")
+                # Let the progress writer run
+                await asyncio.sleep(0)
+                yield f"account{i}", [self.make_follower(i)]
+
+        mock_scraper.analyze_recursive.side_effect = analyze
+        mock_redis.hashes["job:job-1"] = {"job_id": "job-1", "status": "pending"}
+
+        # Long enough that the run never outlasts the first flush interval
+        with patch("app.main.PROGRESS_FLUSH_INTERVAL", 60):
+            await run_analysis("job-1", "testuser", 1)
+
+        # running + first progress tick + completion
+        assert mock_redis.evalsha.await_count == 3
+        job = mock_redis.hashes["job:job-1"]
+        assert job["status"] == "completed"
+        assert job["progress"] == "Completed: found 100 accounts"
+
+    async def test_run_analysis_streams_results(self, client, mock_redis, mock_scraper):
+        """Each account's results should be pushed as soon as it is expanded."""
+        from app.main import run_analysis
+
+        expansions = [
+            ("testuser", [self.make_follower(0), self.make_follower(1)]),
+            ("user0", []),
+            ("user1", [self.make_follower(2)]),
+        ]
+        mock_scraper.analyze_recursive.side_effect = lambda **kwargs: stream(expansions)
+        mock_redis.hashes["job:job-1"] = {"job_id": "job-1", "status": "pending"}
+
+        await run_analysis("job-1", "testuser", 2)
+
+        results = [json.loads(r) for r in mock_redis.lists["job:job-1:results"]]
+        assert [r["username"] for r in results] == ["user0", "user1", "user2"]
+        assert mock_redis.sets["job:job-1:visited"] == {"testuser", "user0", "user1"}
+        assert mock_redis.hashes["job:job-1"]["progress"] == "Completed: found 3 accounts"
+
+    async def test_run_analysis_closes_scraper_when_push_fails(
+        self, client, mock_redis, mock_scraper
+    ):
+        """A failed push should stop the scraper instead of leaving it running."""
+        from redis.exceptions import RedisError
+
+        from app.main import run_analysis
+
+        closed = False
+
+        async def analyze(**kwargs):
+            nonlocal closed
+            try:
+                for i in range(3):
+                    yield f"account{i}", [self.make_follower(i)]
+            finally:
+                closed = True
+
+        pipeline = mock_redis.pipeline.side_effect
+
+        def failing_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            pipe.execute.side_effect = RedisError("connection lost")
+            return pipe
+
+        mock_scraper.analyze_recursive.side_effect = analyze
+        mock_redis.hashes["job:job-1"] = {"job_id": "job-1", "status": "pending"}
+
+        # Let the initial load through, then fail the first write
+        mock_redis.pipeline.side_effect = [pipeline(), failing_pipeline()]
+        await run_analysis("job-1", "testuser", 1)
+
+        assert closed
+        assert mock_redis.hashes["job:job-1"]["status"] == "failed"
+
+    async def test_stop_jobs_leaves_jobs_to_resume(self, client, mock_redis, mock_scraper):
+        """Jobs still running at shutdown should be cancelled but stay resumable."""
+        from app.main import resume_jobs, running_jobs, start_job, stop_jobs
+
+        async def analyze(**kwargs):
+            await asyncio.Event().wait()
+            yield "testuser", [self.make_follower(0)]
+
+        mock_scraper.analyze_recursive.side_effect = analyze
+        mock_redis.hashes["job:job-1"] = {
+            "job_id": "job-1",
+            "status": "pending",
+            "target_username": "testuser",
+            "depth": "1",
+            "min_followers": "3000",
+        }
+        mock_redis.sets["jobs:active"] = {"job-1"}
+
+        start_job("job-1", "testuser", 1)
+        await asyncio.sleep(0)
+        await stop_jobs()
+
+        assert not running_jobs
+        assert mock_redis.sets["jobs:active"] == {"job-1"}
+        assert mock_redis.hashes["job:job-1"]["status"] == "running"
+
+        with patch("app.main.start_job") as start_job:
+            await resume_jobs()
+        start_job.assert_called_once_with("job-1", "testuser", 1)
+
+    async def test_run_analysis_fails_on_invalid_stored_results(self, client, mock_redis):
+        """A job whose stored results cannot be read should fail, not stay active."""
+        from app.main import run_analysis
+
+        mock_redis.hashes["job:job-1"] = {"job_id": "job-1", "status": "running"}
+        mock_redis.lists["job:job-1:results"] = ['{"username": "user0"}']
+        mock_redis.sets["jobs:active"] = {"job-1"}
+
+        await run_analysis("job-1", "testuser", 1)
+
+        assert mock_redis.hashes["job:job-1"]["status"] == "failed"
+        assert not mock_redis.sets["jobs:active"]
+
+    async def test_run_analysis_does_not_recreate_missing_job(self, client, mock_redis):
+        """Updates for a job that no longer exists should be dropped."""
+        from app.main import run_analysis
+
+        await run_analysis("deleted-job", "testuser", 1)
+
+        assert "job:deleted-job" not in mock_redis.hashes
+
+    async def test_update_job_reloads_flushed_script(self, client, mock_redis):
+        """update_job should load the script again after a NOSCRIPT error."""
+        from redis.exceptions import NoScriptError
+
+        from app.main import update_job
+
+        mock_redis.hashes["job:job-1"] = {"job_id": "job-1", "status": "pending"}
+        mock_redis.evalsha.side_effect = [NoScriptError("NOSCRIPT"), 1]
+        mock_redis.script_load.reset_mock()
+
+        await update_job("job:job-1", progress="step")
+
+        mock_redis.script_load.assert_awaited_once()
+        assert mock_redis.evalsha.await_count == 2
+
+    async def test_resume_jobs_restarts_unfinished_jobs(self, client, mock_redis):
+        """Only pending and running jobs should be started again on startup."""
+        from app.main import resume_jobs
+
+        for job_id, status in [("job-1", "running"), ("job-2", "pending"), ("job-3", "completed")]:
+            mock_redis.hashes[f"job:{job_id}"] = {
+                "job_id": job_id,
+                "status": status,
+                "target_username": "testuser",
+                "depth": "2",
+                "min_followers": "3000",
+            }
+        mock_redis.sets["jobs:active"] = {"job-1", "job-2", "job-3", "job-4"}
+
+        with patch("app.main.start_job") as start_job:
+            await resume_jobs()
+
+        started = sorted(call.args for call in start_job.call_args_list)
+        assert started == [("job-1", "testuser", 2), ("job-2", "testuser", 2)]
+        assert mock_redis.sets["jobs:active"] == {"job-1", "job-2"}
+
+    async def test_run_analysis_resumes_from_stored_results(self, client, mock_redis, mock_scraper):
+        """A re-run should hand previous results and expanded accounts to the scraper."""
+        from app.main import run_analysis
+
+        mock_redis.hashes["job:job-1"] = {"job_id": "job-1", "status": "running"}
+        mock_redis.lists["job:job-1:results"] = [self.make_follower(0).model_dump_json()]
+        mock_redis.sets["job:job-1:visited"] = {"testuser"}
+        mock_scraper.analyze_recursive.side_effect = lambda **kwargs: stream(
+            [("user0", [self.make_follower(1)])]
+        )
+
+        await run_analysis("job-1", "testuser", 2)
+
+        kwargs = mock_scraper.analyze_recursive.call_args.kwargs
+        assert kwargs["expanded"] == {"testuser"}
+        assert [f.username for f in kwargs["previous"]] == ["user0"]
+        assert len(mock_redis.lists["job:job-1:results"]) == 2
+        assert mock_redis.hashes["job:job-1"]["progress"] == "Completed: found 2 accounts"
@@ -0,0 +1,406 @@
+"""Tests for the Instagram scraper."""
+
+import asyncio
+import time
+from collections import Counter
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import orjson
+import pytest
+from instagrapi.exceptions import ClientError
+from instagrapi.types import UserShort
+
+import app.scraper as scraper_module
+from app.config import get_settings
+from app.scraper import InstagramScraper, RateLimiter
+
+# username -> (follower_count, is_private, followers)
+GRAPH = {
+    "target": (100, False, ["alice", "bob", "carol", "dave"]),
+    "alice": (5000, False, ["erin", "bob"]),
+    "bob": (4000, False, ["frank"]),
+    "carol": (10, False, []),
+    "dave": (8000, True, ["gina"]),
+    "erin": (6000, False, ["hank"]),
+    "frank": (100, False, []),
+    "gina": (9000, False, []),
+    "hank": (7000, False, []),
+}
+
+
+class FakeRedis:
+    """In-memory stand-in for the async Redis client used by the scraper."""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    async def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Queues commands and runs them against FakeRedis on execute()."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def setex(self, key, ttl, value):
+        self.commands.append(lambda: self.redis.values.__setitem__(key, value))
+        return self
+
+    async def execute(self):
+        return [command() for command in self.commands]
+
+
+def user_info(username):
+    follower_count, is_private, _ = GRAPH[username]
+    return {
+        "user_id": username,
+        "username": username,
+        "full_name": username.title(),
+        "follower_count": follower_count,
+        "following_count": 1,
+        "is_private": is_private,
+    }
+
+
+@pytest.fixture
+def scraper(monkeypatch):
+    """Scraper with Instagram requests stubbed against GRAPH."""
+    monkeypatch.setenv("INSTAGRAM_USERNAME", "test")
+    monkeypatch.setenv("INSTAGRAM_PASSWORD", "test")
+    get_settings.cache_clear()
+
+    scraper = InstagramScraper(FakeRedis())
+    scraper.user_requests = Counter()
+    scraper.follower_requests = Counter()
+
+    async def request_user_info(username):
+        scraper.user_requests[username] += 1
+        return user_info(username)
+
+    async def request_followers(user_id, amount=0):
+        scraper.follower_requests[user_id] += 1
+        await asyncio.sleep(0)
+        return [
+            UserShort(pk=name, username=name, full_name=name.title(), is_private=GRAPH[name][1])
+            for name in GRAPH[user_id][2]
+        ]
+
+    scraper._request_user_info = request_user_info
+    scraper._request_followers = request_followers
+    yield scraper
+    get_settings.cache_clear()
+
+
+async def collect(scraper, **kwargs):
+    kwargs.setdefault("min_followers", 3000)
+    return [
+        follower
+        async for _, followers in scraper.analyze_recursive("target", **kwargs)
+        for follower in followers
+    ]
+
+
+class TestAnalyzeRecursive:
+    """Tests for the breadth-first follower traversal."""
+
+    async def test_finds_followers_with_their_depth(self, scraper):
+        """Matching followers are reported with the depth they were found at."""
+        results = await collect(scraper, max_depth=2)
+
+        assert sorted((f.username, f.depth) for f in results) == [
+            ("alice", 1),
+            ("bob", 1),
+            ("bob", 2),
+            ("dave", 1),
+            ("erin", 2),
+        ]
+
+    async def test_stops_at_max_depth(self, scraper):
+        """Only the target is expanded when max_depth is 1."""
+        results = await collect(scraper, max_depth=1)
+
+        assert {f.depth for f in results} == {1}
+        assert set(scraper.follower_requests) == {"target"}
+
+    async def test_private_accounts_are_not_expanded(self, scraper):
+        """Private followers are reported but their followers are not fetched."""
+        results = await collect(scraper, max_depth=3)
+
+        assert "dave" in {f.username for f in results}
+        assert "dave" not in scraper.follower_requests
+        assert "gina" not in {f.username for f in results}
+
+    async def test_accounts_are_expanded_once(self, scraper):
+        """An account reached through several paths is only expanded once."""
+        results = await collect(scraper, max_depth=3)
+
+        assert ("hank", 3) in {(f.username, f.depth) for f in results}
+        assert max(scraper.follower_requests.values()) == 1
+
+    async def test_cached_profiles_are_not_fetched(self, scraper):
+        """Only followers missing from the cache trigger a profile request."""
+        scraper.redis_client.values["user:alice"] = orjson.dumps(user_info("alice"))
+
+        results = await collect(scraper, max_depth=1)
+
+        assert "alice" in {f.username for f in results}
+        assert set(scraper.user_requests) == {"target", "bob", "carol", "dave"}
+
+    async def test_level_is_expanded_concurrently(self, scraper):
+        """Accounts of the same depth level are expanded at the same time."""
+        in_flight = 0
+        peak = 0
+        request_followers = scraper._request_followers
+
+        async def tracked(user_id, amount=0):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            try:
+                return await request_followers(user_id, amount)
+            finally:
+                in_flight -= 1
+
+        scraper._request_followers = tracked
+        await collect(scraper, max_depth=2)
+
+        # alice and bob are both expanded at depth 2
+        assert peak == 2
+
+    async def test_yields_each_expanded_account(self, scraper):
+        """Followers are yielded together with the account they were found on."""
+        expansions = {
+            name: sorted(f.username for f in followers)
+            async for name, followers in scraper.analyze_recursive(
+                "target", max_depth=2, min_followers=3000
+            )
+        }
+
+        assert expansions == {
+            "target": ["alice", "bob", "dave"],
+            "alice": ["bob", "erin"],
+            "bob": [],
+        }
+
+    async def test_resumes_partially_expanded_level(self, scraper):
+        """A resumed run only expands what the interrupted run had not finished."""
+        expected = await collect(scraper, max_depth=3)
+        # The earlier run expanded target and alice, but was stopped before bob
+        previous = [f for f in expected if f.depth < 3]
+        scraper.follower_requests.clear()
+
+        results = await collect(
+            scraper, max_depth=3, expanded={"target", "alice"}, previous=previous
+        )
+
+        assert [(f.username, f.depth) for f in results] == [("hank", 3)]
+        assert set(scraper.follower_requests) == {"bob", "erin"}
+
+    async def test_failed_fetch_cancels_sibling_fetches(self, scraper):
+        """When one profile request fails, the other pending ones are cancelled."""
+        completed = []
+        request_user_info = scraper._request_user_info
+
+        async def request(username):
+            if username == "alice":
+                raise RuntimeError("boom")
+            if username != "target":
+                await asyncio.sleep(0.05)
+                completed.append(username)
+            return await request_user_info(username)
+
+        scraper._request_user_info = request
+
+        with pytest.raises(RuntimeError):
+            await collect(scraper, max_depth=1)
+        await asyncio.sleep(0.1)
+
+        assert completed == []
+
+    async def test_failed_expansion_cancels_rest_of_level(self, scraper):
+        """When one account of a level fails, the others are not fetched further."""
+        completed = []
+        request_followers = scraper._request_followers
+
+        async def request(user_id, amount=0):
+            if user_id == "alice":
+                raise RuntimeError("boom")
+            if user_id != "target":
+                await asyncio.sleep(0.05)
+                completed.append(user_id)
+            return await request_followers(user_id, amount)
+
+        scraper._request_followers = request
+
+        with pytest.raises(RuntimeError):
+            await collect(scraper, max_depth=2)
+        await asyncio.sleep(0.1)
+
+        assert completed == []
+
+
+class TestFetchUserInfo:
+    """Tests for sharing in-flight profile requests."""
+
+    @pytest.fixture
+    def slow_scraper(self, scraper):
+        """Scraper whose profile requests take a while and record completion."""
+        scraper.completed = []
+        request_user_info = scraper._request_user_info
+
+        async def slow(username):
+            await asyncio.sleep(0.05)
+            info = await request_user_info(username)
+            scraper.completed.append(username)
+            return info
+
+        scraper._request_user_info = slow
+        return scraper
+
+    async def test_concurrent_callers_share_one_request(self, slow_scraper):
+        """Concurrent fetches of the same username issue a single request."""
+        results = await asyncio.gather(*(slow_scraper._fetch_user_info("alice") for _ in range(3)))
+
+        assert slow_scraper.user_requests["alice"] == 1
+        assert all(r == results[0] for r in results)
+        assert not slow_scraper._inflight
+
+    async def test_cancelled_caller_does_not_cancel_others(self, slow_scraper):
+        """Cancelling one caller leaves the shared request to the other callers."""
+        first = asyncio.create_task(slow_scraper._fetch_user_info("alice"))
+        second = asyncio.create_task(slow_scraper._fetch_user_info("alice"))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert (await second)["username"] == "alice"
+        assert slow_scraper.completed == ["alice"]
+
+    async def test_request_cancelled_with_last_caller(self, slow_scraper):
+        """The request stops once nobody is waiting for it anymore."""
+        caller = asyncio.create_task(slow_scraper._fetch_user_info("alice"))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+
+        assert slow_scraper.completed == []
+        assert not slow_scraper._inflight
+
+    async def test_caller_after_cancellation_gets_a_new_request(self, slow_scraper):
+        """A caller arriving while the abandoned request is cancelling is not cancelled."""
+        first = asyncio.create_task(slow_scraper._fetch_user_info("alice"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+
+        assert (await slow_scraper._fetch_user_info("alice"))["username"] == "alice"
+        assert slow_scraper.user_requests["alice"] == 1
+        assert slow_scraper.completed == ["alice"]
+
+
+class TestMemCache:
+    """Tests for the in-process user cache."""
+
+    async def test_least_recently_used_entry_is_evicted(self, scraper, monkeypatch):
+        """The cache drops the user that was read least recently once it is full."""
+        monkeypatch.setattr(scraper_module, "USER_MEM_CACHE_SIZE", 2)
+        scraper._remember_user("alice", user_info("alice"))
+        scraper._remember_user("bob", user_info("bob"))
+        await scraper._get_cached_user("alice")
+        scraper._remember_user("carol", user_info("carol"))
+
+        assert list(scraper._mem_cache) == ["alice", "carol"]
+
+    async def test_expired_entry_falls_back_to_redis(self, scraper, monkeypatch):
+        """An expired entry is dropped and the user is read from Redis again."""
+        scraper._remember_user("alice", user_info("alice"))
+        scraper.redis_client.values["user:alice"] = orjson.dumps({"username": "fresh"})
+        clock = time.monotonic() + scraper_module.USER_MEM_CACHE_TTL + 1
+        monkeypatch.setattr(scraper_module, "time", SimpleNamespace(monotonic=lambda: clock))
+
+        assert await scraper._get_cached_user("alice") == {"username": "fresh"}
+        assert (await scraper._get_cached_users(["alice"]))["alice"] == {"username": "fresh"}
+
+
+class TestRateLimiter:
+    """Tests for the global request rate limiter."""
+
+    async def test_concurrent_callers_are_spaced_out(self, monkeypatch):
+        """Each caller waits one interval longer than the previous one."""
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        monkeypatch.setattr(scraper_module, "time", SimpleNamespace(monotonic=lambda: 100.0))
+        monkeypatch.setattr(scraper_module, "asyncio", SimpleNamespace(sleep=sleep))
+        limiter = RateLimiter(10)
+
+        for _ in range(3):
+            await limiter.wait()
+
+        assert delays == pytest.approx([0, 0.1, 0.2])
+
+    async def test_idle_limiter_does_not_wait(self, monkeypatch):
+        """A slot that is already due is granted without sleeping."""
+        delays = []
+        clock = 100.0
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        monkeypatch.setattr(scraper_module, "time", SimpleNamespace(monotonic=lambda: clock))
+        monkeypatch.setattr(scraper_module, "asyncio", SimpleNamespace(sleep=sleep))
+        limiter = RateLimiter(10)
+
+        await limiter.wait()
+        clock += 1
+        await limiter.wait()
+
+        assert delays == [0, 0]
+
+
+class TestGetFollowers:
+    """Tests for fetching follower lists."""
+
+    async def test_followers_are_converted_to_dicts(self, scraper):
+        """Followers are returned as dicts of the fields UserShort carries."""
+        followers = await scraper.get_followers("alice")
+
+        assert followers == [
+            {"user_id": "erin", "username": "erin", "full_name": "Erin", "is_private": False},
+            {"user_id": "bob", "username": "bob", "full_name": "Bob", "is_private": False},
+        ]
+
+    async def test_client_error_returns_no_followers(self, scraper):
+        """An Instagram error while listing followers yields an empty list."""
+
+        async def request(user_id, amount=0):
+            raise ClientError("rate limited")
+
+        scraper._request_followers = request
+
+        assert await scraper.get_followers("target") == []
+
+    async def test_amount_is_passed_to_the_client(self, scraper):
+        """The requested amount is forwarded to instagrapi's user_followers."""
+        scraper.client = MagicMock()
+        scraper.client.user_followers.return_value = {"1": "alice", "2": "bob"}
+
+        followers = await InstagramScraper._request_followers(scraper, 42, amount=2)
+
+        assert followers == ["alice", "bob"]
+        scraper.client.user_followers.assert_called_once_with(42, amount=2)